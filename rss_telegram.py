@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
 import os
 import time
-import json
+import orjson
+import xxhash
 import logging
 import feedparser
 from datetime import datetime
 import requests
 import asyncio
+import uvloop
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Bot
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 import re
-import html
+from selectolax.lexbor import LexborHTMLParser
+from aiolimiter import AsyncLimiter
 
 # Logging configuration
 logging.basicConfig(
@@ -31,18 +36,56 @@ TELEGRAM_MESSAGE_LINKS_BUTTON= os.environ.get('TELEGRAM_MESSAGE_LINKS_BUTTON', '
 INCLUDE_DESCRIPTION = os.environ.get('INCLUDE_DESCRIPTION', 'false').lower() == 'true'  # Default: false
 DISABLE_NOTIFICATION = os.environ.get('DISABLE_NOTIFICATION', 'false').lower() == 'true'  # Default: false
 MAX_MESSAGE_LENGTH = 4096  # Maximum character limit for Telegram messages
+MAX_FETCH_WORKERS = 32  # Maximum number of feeds fetched in parallel
+MAX_SEND_RETRIES = 3  # Attempts per message when Telegram asks to retry later
 
-# File to store already sent articles
-HISTORY_FILE = "/app/data/sent_items.json"
+# Telegram rate limits: 30 messages per second overall, 1 message per second per chat
+global_limiter = AsyncLimiter(30, 1)
+chat_limiters = {}
+
+# Characters that must be escaped in MarkdownV2 text and inside link URLs
+_MDV2 = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+_MDV2_URL = re.compile(r'([)\\])')
+
+# Sent when the bot starts, already escaped for MarkdownV2
+STARTUP_MESSAGE = "🤖 *RSS Monitoring Bot started\\!*\nActive feed monitoring\\. Configuration loaded from file\\."
+
+# File to store already sent articles (append-only, one JSON record per line)
+HISTORY_FILE = "/app/data/sent_items.ndjson"
+# Previous JSON history file, migrated on first start
+LEGACY_HISTORY_FILE = "/app/data/sent_items.json"
+# File to store the ETag/Last-Modified validators of each feed
+FEED_STATE_FILE = "/app/data/feed_state.json"
+HISTORY_LIMIT = 200  # Minimum number of entry IDs kept per feed
+COMPACTION_INTERVAL = 7 * 24 * 3600  # Compact the history once a week
 
 
 def strip_html(html_content: str) -> str:
     """Convert HTML to plain text by removing tags and unescaping entities."""
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', html_content)
-    # Unescape HTML entities and normalize whitespace
-    text = html.unescape(text)
-    return ' '.join(text.split())
+    # Parse with selectolax's lexbor backend (entities are decoded by the parser) and normalize whitespace
+    return ' '.join(LexborHTMLParser(html_content).text(separator=' ').split())
+
+
+def hash_entry_id(entry_id: str) -> int:
+    """Hash an entry ID (often a long URL) to a 64-bit integer for the history."""
+    return xxhash.xxh64_intdigest(entry_id.encode('utf-8'))
+
+
+def escape_md(text: str) -> str:
+    """Escape text for Telegram MarkdownV2."""
+    return _MDV2.sub(r'\\\1', text)
+
+
+def escape_md_url(url: str) -> str:
+    """Escape a URL for use inside a MarkdownV2 inline link."""
+    return _MDV2_URL.sub(r'\\\1', url)
+
+
+def get_chat_limiter(chat_id):
+    """Return the rate limiter for a chat, creating it on first use."""
+    if chat_id not in chat_limiters:
+        chat_limiters[chat_id] = AsyncLimiter(1, 1)
+    return chat_limiters[chat_id]
 
 
 def load_feeds():
@@ -63,41 +106,195 @@ def load_feeds():
 
 
 def load_sent_items():
-    """Load history of already sent articles."""
+    """Load history of already sent articles.
+
+    Each feed maps to an insertion-ordered dict of hashed entry IDs, used as an ordered set
+    so duplicate checks are O(1) instead of a list scan.
+    """
+    sent_items = {}
     try:
-        with open(HISTORY_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+        with open(HISTORY_FILE, 'rb') as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                    sent_items.setdefault(record['feed'], {})[record['id']] = None
+                except (orjson.JSONDecodeError, KeyError, TypeError):
+                    # Skip lines left incomplete by an interrupted write
+                    continue
+        return sent_items
+    except FileNotFoundError:
+        pass
 
+    try:
+        with open(LEGACY_HISTORY_FILE, 'rb') as f:
+            sent_items = {
+                feed_url: dict.fromkeys(hash_entry_id(entry_id) for entry_id in ids)
+                for feed_url, ids in orjson.loads(f.read()).items()
+            }
+        logger.info(f"Migrating history from {LEGACY_HISTORY_FILE} to {HISTORY_FILE}")
+        write_sent_items(sent_items)
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        pass
+    return sent_items
 
-def save_sent_items(sent_items):
-    """Save history of sent articles."""
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(sent_items, f)
 
-async def send_telegram_message(bot, chat_id, message, message_thread_id=None, reply_markup=None):
+def append_sent_items(new_items):
+    """Append newly sent articles to the history log and flush them to disk."""
+    with open(HISTORY_FILE, 'a+b') as f:
+        # Start on a new line if an interrupted write left a partial record
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        for feed_url, entry_id in new_items:
+            f.write(orjson.dumps({"feed": feed_url, "id": entry_id}) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def trim_history(history, limit):
+    """Evict the oldest IDs of a feed's history beyond limit."""
+    while len(history) > limit:
+        del history[next(iter(history))]
+
+
+def add_sent_item(history, entry_id, limit):
+    """Record an entry ID in a feed's history, evicting the oldest IDs beyond limit."""
+    history[entry_id] = None
+    trim_history(history, limit)
+
+
+def find_new_entries(history, entries):
+    """Return (entry_id, entry) pairs for entries not yet in a feed's history, in feed order.
+
+    Entries are walked oldest first (feeds list newest first) and IDs that are
+    already known are moved to the end of the history, so eviction only drops
+    IDs that are no longer listed in the feed.
+    """
+    new_entries = []
+    new_ids = set()
+    for entry in reversed(entries):
+        entry_id = hash_entry_id(entry.get('id') or entry.get('link', ''))
+        if entry_id in history:
+            history[entry_id] = history.pop(entry_id)
+        elif entry_id not in new_ids:
+            new_ids.add(entry_id)
+            new_entries.append((entry_id, entry))
+    new_entries.reverse()
+    return new_entries
+
+
+def compact_sent_items(sent_items, feed_state):
+    """Bound the history and rewrite the log.
+
+    Feeds no longer listed in the feeds file are dropped from the history and
+    from feed_state, and every other feed is trimmed to its history limit.
+    """
+    feeds = set(load_feeds())
+    # An empty list may mean the feeds file could not be read; keep everything rather than wipe it
+    if feeds:
+        for feed_url in [feed_url for feed_url in sent_items if feed_url not in feeds]:
+            del sent_items[feed_url]
+        for feed_url in [feed_url for feed_url in feed_state if feed_url not in feeds]:
+            del feed_state[feed_url]
+
+    for feed_url, history in sent_items.items():
+        # Feeds never fetched have no known length, so they are left untrimmed
+        limit = feed_state.get(feed_url, {}).get('history_limit')
+        if limit:
+            trim_history(history, limit)
+
+    write_sent_items(sent_items)
+
+
+def write_sent_items(sent_items):
+    """Rewrite the history log with only the items held in memory."""
+    tmp_file = HISTORY_FILE + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        for feed_url, ids in sent_items.items():
+            for entry_id in ids:
+                f.write(orjson.dumps({"feed": feed_url, "id": entry_id}) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, HISTORY_FILE)
+
+    # Persist the rename itself, so a crash cannot leave the old or an empty log
+    dir_fd = os.open(os.path.dirname(HISTORY_FILE) or '.', os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def load_feed_state():
+    """Load the HTTP cache validators of each feed."""
     try:
-        kwargs = {
-            "chat_id": chat_id,
-            "text": message,
-            "parse_mode": ParseMode.MARKDOWN,
-            "disable_notification": DISABLE_NOTIFICATION
-        }
+        with open(FEED_STATE_FILE, 'rb') as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+
+
+def save_feed_state(feed_state):
+    """Save the HTTP cache validators of each feed."""
+    with open(FEED_STATE_FILE, 'wb') as f:
+        f.write(orjson.dumps(feed_state))
+
+async def deliver_telegram_message(bot, chat_id, message, message_thread_id=None, reply_markup=None):
+    """Send a message, retrying when Telegram asks to wait; raises if it cannot be delivered."""
+    kwargs = {
+        "chat_id": chat_id,
+        "text": message,
+        "parse_mode": ParseMode.MARKDOWN_V2,
+        "disable_notification": DISABLE_NOTIFICATION
+    }
 
-        if message_thread_id is not None:
-            kwargs["message_thread_id"] = message_thread_id
+    if message_thread_id is not None:
+        kwargs["message_thread_id"] = message_thread_id
 
-        if reply_markup is not None:
-            kwargs["reply_markup"] = reply_markup
+    if reply_markup is not None:
+        kwargs["reply_markup"] = reply_markup
 
-        await bot.send_message(**kwargs)
+    for attempt in range(1, MAX_SEND_RETRIES + 1):
+        try:
+            async with global_limiter, get_chat_limiter(chat_id):
+                await bot.send_message(**kwargs)
+            return
+        except RetryAfter as e:
+            if attempt == MAX_SEND_RETRIES:
+                raise
+            logger.warning(f"Rate limited by Telegram, retrying in {e.retry_after} seconds")
+            await asyncio.sleep(e.retry_after)
+
+async def send_telegram_message(bot, chat_id, message, message_thread_id=None, reply_markup=None):
+    try:
+        await deliver_telegram_message(bot, chat_id, message, message_thread_id, reply_markup)
         return True
     except Exception as e:
         logger.error(f"Error sending notification: {e}")
         return False
 
-async def send_grouped_messages(bot, messages_by_feed):
+async def send_and_record(bot, sent_items, message, entries, reply_markup=None):
+    """Send a notification and record its entries in the history once handled.
+
+    Entries are recorded once the message is delivered, or once Telegram rejects it
+    outright (BadRequest), since resending the same message would fail again.
+    Transient failures (rate limits, timeouts, network errors) leave the entries
+    unrecorded so they are retried on the next check.
+    """
+    try:
+        await deliver_telegram_message(bot, TELEGRAM_CHAT_ID, message, TELEGRAM_FORUM_ID, reply_markup)
+    except BadRequest as e:
+        logger.error(f"Telegram rejected notification, not retrying it: {e}")
+    except Exception as e:
+        logger.error(f"Error sending notification, retrying on next check: {e}")
+        return
+
+    # Record oldest first so the history keeps the feed's chronological order
+    for entry in reversed(entries):
+        add_sent_item(sent_items.setdefault(entry['feed_url'], {}), entry['id'], entry['history_limit'])
+    append_sent_items([(entry['feed_url'], entry['id']) for entry in entries])
+
+async def send_grouped_messages(bot, messages_by_feed, sent_items):
     """Send messages grouped by feed."""
     if not messages_by_feed:
         logger.info("No new content to notify")
@@ -107,37 +304,41 @@ async def send_grouped_messages(bot, messages_by_feed):
         if not entries:
             continue
 
-        header = f"📢 *New content from {feed_title}*\n\n"
-        entries_text = ""
+        header = f"📢 *New content from {escape_md(feed_title)}*\n\n"
+        parts = []
+        part_entries = []
+        current_len = len(header)
 
         for entry in entries:
-            entry_text = f"• *{entry['title']}*\n"
+            entry_text = f"• *{escape_md(entry['title'])}*\n"
 
-            if INCLUDE_DESCRIPTION and entry.get('description'):
-                desc = strip_html(entry['description'])
+            desc = strip_html(entry['description']) if INCLUDE_DESCRIPTION and entry.get('description') else ""
+            if desc:
                 if len(desc) > 150:
                     desc = desc[:147] + '...'
-                entry_text += f"  _{desc}_\n"
+                entry_text += f"  _{escape_md(desc)}_\n"
 
             if TELEGRAM_MESSAGE_LINKS_BUTTON:
-                entry_text += f"\n  [Open Link]({entry['link']})\n\n"
+                entry_text += f"\n  [Open Link]({escape_md_url(entry['link'])})\n\n"
             else:
-                entry_text += f"\n  {entry['link']}\n\n"
+                entry_text += f"\n  {escape_md(entry['link'])}\n\n"
 
-            if len(header) + len(entries_text) + len(entry_text) > MAX_MESSAGE_LENGTH:
-                await send_telegram_message(bot, TELEGRAM_CHAT_ID, header + entries_text, TELEGRAM_FORUM_ID)
-                entries_text = entry_text
+            if parts and current_len + len(entry_text) > MAX_MESSAGE_LENGTH:
+                await send_and_record(bot, sent_items, header + "".join(parts), part_entries)
+                parts = [entry_text]
+                part_entries = [entry]
+                current_len = len(header) + len(entry_text)
             else:
-                entries_text += entry_text
+                parts.append(entry_text)
+                part_entries.append(entry)
+                current_len += len(entry_text)
 
-        if entries_text:
-            await send_telegram_message(bot, TELEGRAM_CHAT_ID, header + entries_text, TELEGRAM_FORUM_ID)
-
-        await asyncio.sleep(1)
+        if parts:
+            await send_and_record(bot, sent_items, header + "".join(parts), part_entries)
 
     return True
 
-async def send_single_messages(bot, messages_by_feed):
+async def send_single_messages(bot, messages_by_feed, sent_items):
     """Send one message per item."""
     if not messages_by_feed:
         logger.info("No new content to notify")
@@ -145,74 +346,125 @@ async def send_single_messages(bot, messages_by_feed):
 
     for feed_title, entries in messages_by_feed.items():
         for entry in entries:
-            message = f"📢 *New content from {feed_title}*\n\n*{entry['title']}*\n"
+            message = f"📢 *New content from {escape_md(feed_title)}*\n\n*{escape_md(entry['title'])}*\n"
 
-            if INCLUDE_DESCRIPTION and entry.get('description'):
-                desc = strip_html(entry['description'])
+            desc = strip_html(entry['description']) if INCLUDE_DESCRIPTION and entry.get('description') else ""
+            if desc:
                 if len(desc) > 150:
                     desc = desc[:147] + '...'
-                message += f"  _{desc}_\n"
+                message += f"  _{escape_md(desc)}_\n"
 
             reply_markup = None
             if TELEGRAM_MESSAGE_LINKS_BUTTON:
                 reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Open Link", url=entry['link'])]])
             else:
-                message += f"\n{entry['link']}"
+                message += f"\n{escape_md(entry['link'])}"
 
-            await send_telegram_message(bot, TELEGRAM_CHAT_ID, message, TELEGRAM_FORUM_ID, reply_markup)
-            await asyncio.sleep(1)
+            # Sent one at a time: every message goes to the same chat, whose 1 msg/s
+            # limiter sets the pace anyway, and this keeps messages in feed order
+            try:
+                await send_and_record(bot, sent_items, message, [entry], reply_markup)
+            except Exception as e:
+                logger.error(f"Error sending notification: {e}")
 
     return True
 
-async def check_feeds(bot):
-    """Check RSS feeds for new articles."""
-    sent_items = load_sent_items()
+def fetch_feed(feed_url, state):
+    """Download and parse a single RSS feed.
+
+    The stored ETag/Last-Modified values are sent as a conditional GET, so an
+    unchanged feed comes back as a 304 with no entries to parse.
+    """
+    logger.info(f"Checking feed: {feed_url}")
+    return feedparser.parse(feed_url, etag=state.get('etag'), modified=state.get('modified'))
+
+async def fetch_feeds(feeds, feed_state):
+    """Download and parse RSS feeds, in parallel when there are more than a couple."""
+    if len(feeds) <= 2:
+        results = []
+        for feed_url in feeds:
+            try:
+                results.append(fetch_feed(feed_url, feed_state.get(feed_url, {})))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(feeds))) as pool:
+        return await asyncio.gather(
+            *(loop.run_in_executor(pool, fetch_feed, feed_url, feed_state.get(feed_url, {})) for feed_url in feeds),
+            return_exceptions=True
+        )
+
+async def check_feeds(bot, sent_items, feed_state):
+    """Check RSS feeds for new articles.
+
+    Updates sent_items and feed_state in place. Entries are recorded in the
+    history, and appended to the log, only once the message containing them has
+    been delivered or permanently rejected; a feed keeps its old ETag/Last-Modified
+    values until all of its new entries are recorded, so entries that hit a
+    transient failure are retried next poll.
+    """
     feeds = load_feeds()
 
     if not feeds:
         logger.warning("No feeds to check. Add feeds to the configuration file.")
-        return sent_items
-
+        return
     messages_by_feed = {}
+    validators = {}
+    pending_ids = {}
+    parsed_feeds = await fetch_feeds(feeds, feed_state)
 
-    for feed_url in feeds:
-        if not feed_url.strip():
-            continue
-
-        logger.info(f"Checking feed: {feed_url}")
-
+    for feed_url, feed in zip(feeds, parsed_feeds):
         try:
-            feed = feedparser.parse(feed_url)
+            if isinstance(feed, Exception):
+                raise feed
+
+            if feed.get('status') == 304:
+                logger.info(f"Feed not modified: {feed_url}")
+                continue
 
             if not feed.entries:
                 logger.warning(f"No entries found in feed: {feed_url}")
                 continue
 
-            feed_title = feed.feed.title if hasattr(feed.feed, 'title') else feed_url
-            sent_items.setdefault(feed_url, [])
+            feed_title = feed.feed.get('title', feed_url)
+            history = sent_items.setdefault(feed_url, {})
             messages_by_feed.setdefault(feed_title, [])
-
-            for entry in feed.entries:
-                entry_id = entry.id if hasattr(entry, 'id') else entry.link
-                if entry_id in sent_items[feed_url]:
-                    continue
-
-                title = entry.title if hasattr(entry, 'title') else "No title"
-                link = entry.link if hasattr(entry, 'link') else ""
+            # Leave headroom over the feed length, so current entries are never evicted and resent
+            history_limit = max(HISTORY_LIMIT, 2 * len(feed.entries))
+            feed_state.setdefault(feed_url, {})['history_limit'] = history_limit
+            new_entries = find_new_entries(history, feed.entries)
+            pending_ids[feed_url] = [entry_id for entry_id, _ in new_entries]
+
+            for entry_id, entry in new_entries:
+                title = entry.get('title', "No title")
+                link = entry.get('link', "")
                 description = ""
                 if INCLUDE_DESCRIPTION:
-                    description = getattr(entry, 'description', '') or getattr(entry, 'summary', '')
-
-                messages_by_feed[feed_title].append({'title': title, 'link': link, 'description': description})
-                sent_items[feed_url].append(entry_id)
+                    description = entry.get('description') or entry.get('summary', '')
+
+                messages_by_feed[feed_title].append({
+                    'title': title,
+                    'link': link,
+                    'description': description,
+                    'feed_url': feed_url,
+                    'id': entry_id,
+                    'history_limit': history_limit
+                })
+
+            validators[feed_url] = {'etag': feed.get('etag'), 'modified': feed.get('modified')}
         except Exception as e:
             logger.error(f"Error checking feed {feed_url}: {e}")
 
     if TELEGRAM_GROUPED_MESSAGES:
-        await send_grouped_messages(bot, messages_by_feed)
+        await send_grouped_messages(bot, messages_by_feed, sent_items)
     else:
-        await send_single_messages(bot, messages_by_feed)
-    return sent_items
+        await send_single_messages(bot, messages_by_feed, sent_items)
+
+    for feed_url, state in validators.items():
+        if all(entry_id in sent_items[feed_url] for entry_id in pending_ids[feed_url]):
+            feed_state[feed_url].update(state)
 
 async def main_async():
     logger.info("Starting RSS feed monitoring")
@@ -229,16 +481,27 @@ async def main_async():
             raise ValueError("TELEGRAM_FORUM_ID must be an integer")
 
     bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    await send_telegram_message(bot, TELEGRAM_CHAT_ID, "🤖 *RSS Monitoring Bot started!*\nActive feed monitoring. Configuration loaded from file.", TELEGRAM_FORUM_ID)
+    await send_telegram_message(bot, TELEGRAM_CHAT_ID, STARTUP_MESSAGE, TELEGRAM_FORUM_ID)
+
+    sent_items = load_sent_items()
+    feed_state = load_feed_state()
+    last_compaction = 0
 
     while True:
-        sent_items = await check_feeds(bot)
-        save_sent_items(sent_items)
+        await check_feeds(bot, sent_items, feed_state)
+
+        # Compact after polling, so the history limit of every fetched feed is known
+        if time.time() - last_compaction >= COMPACTION_INTERVAL:
+            compact_sent_items(sent_items, feed_state)
+            last_compaction = time.time()
+
+        save_feed_state(feed_state)
         logger.info(f"Next check in {CHECK_INTERVAL} seconds")
         await asyncio.sleep(CHECK_INTERVAL)
 
 
 def main():
+    uvloop.install()
     asyncio.run(main_async())
 
 if __name__ == "__main__":
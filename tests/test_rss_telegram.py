@@ -0,0 +1,235 @@
+import asyncio
+
+import pytest
+
+from aiolimiter import AsyncLimiter
+from telegram.error import BadRequest, RetryAfter, TimedOut
+
+import rss_telegram
+
+
+def make_feed(newest, length):
+    """Build a newest-first feed whose entries are numbered newest down to newest - length + 1."""
+    return [{'id': f"https://example.com/item/{n}"} for n in range(newest, newest - length, -1)]
+
+
+@pytest.mark.parametrize("length", [150, 199, 200, 250])
+def test_history_does_not_resend_long_newest_first_feed(length):
+    history = {}
+    limit = max(rss_telegram.HISTORY_LIMIT, 2 * length)
+
+    newest = length
+    first = rss_telegram.find_new_entries(history, make_feed(newest, length))
+    assert len(first) == length
+    for entry_id, _ in reversed(first):
+        rss_telegram.add_sent_item(history, entry_id, limit)
+
+    # Each poll the feed gains one item at the top and drops the oldest
+    for _ in range(3 * length):
+        newest += 1
+        new_entries = rss_telegram.find_new_entries(history, make_feed(newest, length))
+        assert [entry['id'] for _, entry in new_entries] == [f"https://example.com/item/{newest}"]
+        for entry_id, _ in reversed(new_entries):
+            rss_telegram.add_sent_item(history, entry_id, limit)
+        assert len(history) <= limit
+
+
+def test_find_new_entries_keeps_feed_order_and_skips_duplicates():
+    entries = [{'id': 'c'}, {'id': 'b'}, {'id': 'b'}, {'link': 'a'}]
+    new_entries = rss_telegram.find_new_entries({}, entries)
+    assert [entry.get('id') or entry['link'] for _, entry in new_entries] == ['c', 'b', 'a']
+
+
+class FakeBot:
+    def __init__(self, error=None):
+        self.error = error
+        self.messages = []
+
+    async def send_message(self, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.messages.append(kwargs['text'])
+
+
+@pytest.mark.parametrize("grouped", [True, False])
+def test_markup_only_description_is_omitted(monkeypatch, tmp_path, grouped):
+    monkeypatch.setattr(rss_telegram, 'HISTORY_FILE', str(tmp_path / 'sent_items.ndjson'))
+    monkeypatch.setattr(rss_telegram, 'INCLUDE_DESCRIPTION', True)
+    bot = FakeBot()
+    entry = {'title': 'Title', 'link': 'https://example.com/1', 'description': '<img src="cover.png">',
+             'feed_url': 'https://example.com/rss', 'id': 1, 'history_limit': rss_telegram.HISTORY_LIMIT}
+
+    send = rss_telegram.send_grouped_messages if grouped else rss_telegram.send_single_messages
+    asyncio.run(send(bot, {'Feed': [entry]}, {}))
+
+    assert len(bot.messages) == 1
+    assert '__' not in bot.messages[0]
+
+
+def test_hash_entry_id_is_stable_64_bit_int():
+    entry_id = rss_telegram.hash_entry_id("https://example.com/item/1")
+    assert entry_id == rss_telegram.hash_entry_id("https://example.com/item/1")
+    assert 0 <= entry_id < 2 ** 64
+
+
+def test_legacy_history_is_migrated_with_hashed_ids(monkeypatch, tmp_path):
+    monkeypatch.setattr(rss_telegram, 'HISTORY_FILE', str(tmp_path / 'sent_items.ndjson'))
+    monkeypatch.setattr(rss_telegram, 'LEGACY_HISTORY_FILE', str(tmp_path / 'sent_items.json'))
+    (tmp_path / 'sent_items.json').write_text('{"https://example.com/rss": ["a", "b"]}')
+
+    sent_items = rss_telegram.load_sent_items()
+
+    assert list(sent_items["https://example.com/rss"]) == [rss_telegram.hash_entry_id("a"), rss_telegram.hash_entry_id("b")]
+    assert rss_telegram.load_sent_items() == sent_items
+
+
+def run_check(monkeypatch, tmp_path, bot, sent_items, feed_state):
+    monkeypatch.setattr(rss_telegram, 'HISTORY_FILE', str(tmp_path / 'sent_items.ndjson'))
+    monkeypatch.setattr(rss_telegram, 'load_feeds', lambda: ["https://example.com/rss"])
+
+    async def fetch_feeds(feeds, state):
+        return [rss_telegram.feedparser.FeedParserDict(
+            status=200,
+            etag='"v2"',
+            feed=rss_telegram.feedparser.FeedParserDict(title="Feed"),
+            entries=[rss_telegram.feedparser.FeedParserDict(id="a", title="A", link="https://example.com/a")]
+        )]
+
+    monkeypatch.setattr(rss_telegram, 'fetch_feeds', fetch_feeds)
+    asyncio.run(rss_telegram.check_feeds(bot, sent_items, feed_state))
+
+
+def test_entries_failing_transiently_are_retried(monkeypatch, tmp_path):
+    sent_items = {}
+    feed_state = {"https://example.com/rss": {'etag': '"v1"', 'modified': None}}
+
+    run_check(monkeypatch, tmp_path, FakeBot(error=TimedOut()), sent_items, feed_state)
+    assert not sent_items["https://example.com/rss"]
+    assert feed_state["https://example.com/rss"]['etag'] == '"v1"'
+    assert not (tmp_path / 'sent_items.ndjson').exists()
+
+    bot = FakeBot()
+    run_check(monkeypatch, tmp_path, bot, sent_items, feed_state)
+    assert len(bot.messages) == 1
+    assert list(sent_items["https://example.com/rss"]) == [rss_telegram.hash_entry_id("a")]
+    assert feed_state["https://example.com/rss"]['etag'] == '"v2"'
+    assert rss_telegram.load_sent_items() == sent_items
+
+
+def test_entries_rejected_by_telegram_are_not_resent(monkeypatch, tmp_path):
+    sent_items = {}
+    feed_state = {"https://example.com/rss": {'etag': '"v1"', 'modified': None}}
+
+    run_check(monkeypatch, tmp_path, FakeBot(error=BadRequest("Can't parse entities")), sent_items, feed_state)
+    assert list(sent_items["https://example.com/rss"]) == [rss_telegram.hash_entry_id("a")]
+    assert feed_state["https://example.com/rss"]['etag'] == '"v2"'
+    assert rss_telegram.load_sent_items() == sent_items
+
+    bot = FakeBot()
+    run_check(monkeypatch, tmp_path, bot, sent_items, feed_state)
+    assert bot.messages == []
+
+
+def test_append_after_truncated_record(monkeypatch, tmp_path):
+    history_file = tmp_path / 'sent_items.ndjson'
+    monkeypatch.setattr(rss_telegram, 'HISTORY_FILE', str(history_file))
+    history_file.write_bytes(b'{"feed": "f", "id": 1}\n{"feed": "f", "i')
+
+    rss_telegram.append_sent_items([("f", 2)])
+
+    assert rss_telegram.load_sent_items() == {"f": {1: None, 2: None}}
+
+
+class RateLimitedBot:
+    def __init__(self, rate_limited_attempts):
+        self.rate_limited_attempts = rate_limited_attempts
+        self.attempts = 0
+
+    async def send_message(self, **kwargs):
+        self.attempts += 1
+        if self.attempts <= self.rate_limited_attempts:
+            raise RetryAfter(0)
+
+
+@pytest.fixture
+def unlimited_chats(monkeypatch):
+    monkeypatch.setattr(rss_telegram, 'get_chat_limiter', lambda chat_id: AsyncLimiter(1000, 1))
+
+
+def test_send_retries_after_rate_limit(unlimited_chats):
+    bot = RateLimitedBot(rate_limited_attempts=1)
+    assert asyncio.run(rss_telegram.send_telegram_message(bot, "1", "text")) is True
+    assert bot.attempts == 2
+
+
+def test_send_gives_up_after_max_retries(unlimited_chats):
+    bot = RateLimitedBot(rate_limited_attempts=rss_telegram.MAX_SEND_RETRIES + 1)
+    assert asyncio.run(rss_telegram.send_telegram_message(bot, "1", "text")) is False
+    assert bot.attempts == rss_telegram.MAX_SEND_RETRIES
+
+
+def test_compaction_trims_history_and_drops_removed_feeds(monkeypatch, tmp_path):
+    monkeypatch.setattr(rss_telegram, 'HISTORY_FILE', str(tmp_path / 'sent_items.ndjson'))
+    monkeypatch.setattr(rss_telegram, 'load_feeds', lambda: ["https://a.example/rss", "https://b.example/rss"])
+    sent_items = {
+        "https://a.example/rss": dict.fromkeys(range(10)),
+        "https://b.example/rss": dict.fromkeys(range(10)),
+        "https://removed.example/rss": dict.fromkeys(range(10)),
+    }
+    feed_state = {
+        "https://a.example/rss": {'etag': None, 'modified': None, 'history_limit': 4},
+        "https://removed.example/rss": {'etag': None, 'modified': None, 'history_limit': 4},
+    }
+
+    rss_telegram.compact_sent_items(sent_items, feed_state)
+
+    assert list(sent_items["https://a.example/rss"]) == [6, 7, 8, 9]
+    assert len(sent_items["https://b.example/rss"]) == 10
+    assert "https://removed.example/rss" not in sent_items
+    assert list(feed_state) == ["https://a.example/rss"]
+    assert rss_telegram.load_sent_items() == sent_items
+
+
+def test_compaction_keeps_history_when_feeds_file_is_empty(monkeypatch, tmp_path):
+    monkeypatch.setattr(rss_telegram, 'HISTORY_FILE', str(tmp_path / 'sent_items.ndjson'))
+    monkeypatch.setattr(rss_telegram, 'load_feeds', lambda: [])
+    sent_items = {"https://a.example/rss": dict.fromkeys(range(3))}
+    feed_state = {"https://a.example/rss": {'history_limit': 200}}
+
+    rss_telegram.compact_sent_items(sent_items, feed_state)
+
+    assert list(sent_items) == ["https://a.example/rss"]
+    assert list(feed_state) == ["https://a.example/rss"]
+
+
+@pytest.mark.parametrize("char", list("_*[]()~`>#+-=|{}.!\\"))
+def test_escape_md_escapes_every_reserved_character(char):
+    assert rss_telegram.escape_md(f"a{char}b") == f"a\\{char}b"
+
+
+def test_escape_md_leaves_plain_text_alone():
+    assert rss_telegram.escape_md("Plain text, with: 'quotes' & emoji 📢") == "Plain text, with: 'quotes' & emoji 📢"
+
+
+def test_escape_md_url_escapes_only_closing_parenthesis_and_backslash():
+    assert rss_telegram.escape_md_url("https://example.com/a_(b)\\c.html") == "https://example.com/a_(b\\)\\\\c.html"
+
+
+def test_description_is_escaped_after_truncation(monkeypatch, tmp_path):
+    monkeypatch.setattr(rss_telegram, 'HISTORY_FILE', str(tmp_path / 'sent_items.ndjson'))
+    monkeypatch.setattr(rss_telegram, 'INCLUDE_DESCRIPTION', True)
+    bot = FakeBot()
+    entry = {'title': 'Title', 'link': 'https://example.com/1', 'description': "a" * 145 + "_.!" + "b" * 10,
+             'feed_url': 'https://example.com/rss', 'id': 1, 'history_limit': rss_telegram.HISTORY_LIMIT}
+
+    asyncio.run(rss_telegram.send_single_messages(bot, {'Feed': [entry]}, {}))
+
+    assert f"  _{'a' * 145}\\_\\.\\.\\.\\._\n" in bot.messages[0]
+
+
+def test_startup_message_is_escaped():
+    expected = (
+        "🤖 *" + rss_telegram.escape_md("RSS Monitoring Bot started!") + "*\n"
+        + rss_telegram.escape_md("Active feed monitoring. Configuration loaded from file.")
+    )
+    assert rss_telegram.STARTUP_MESSAGE == expected